@@ -1,20 +1,35 @@
+import math
 import os
 import uuid
+import click
 from flask import (
     Flask, render_template, url_for, redirect,
-    request, flash, abort, session
+    request, flash, abort, session, jsonify
 )
 from flask_login import (
     LoginManager, login_user, logout_user, current_user, login_required
 )
+from flask_wtf.csrf import validate_csrf
+from sqlalchemy import delete, inspect, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, contains_eager, defer
+from sqlalchemy.schema import CreateColumn, CreateTable
 from werkzeug.utils import secure_filename
+from wtforms.validators import ValidationError
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional — uploads are then stored unresized
+    Image = None
 
 from forms import (
     RegistrationForm, LoginForm, PostForm, CommentForm,
     LikeForm, DeleteForm, EditProfileForm
 )
-from models import db, User, Post, Comment, Like
+from models import db, User, Post, Comment, Like, make_excerpt
+from extensions import cache
 import config
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -42,6 +57,7 @@ app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["MAX_CONTENT_LENGTH"] = 5 * 1024 * 1024  # 5 MB hard limit
 
 db.init_app(app)
+cache.init_app(app)
 
 
 login_manager = LoginManager(app)
@@ -56,6 +72,9 @@ login_manager.login_message_category = "info"
 ALLOWED_IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "gif"}
 ALLOWED_CV_EXTENSIONS = {"pdf"}
 
+FEED_PAGE_SIZE = 20      # posts per /home page
+NETWORK_PAGE_SIZE = 24   # user cards per /network page (fills 2- and 3-col grids)
+
 
 def _allowed_file(filename: str, allowed: set) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in allowed
@@ -72,16 +91,22 @@ def save_picture(form_picture) -> str:
     picture_fn = random_hex + f_ext
     picture_path = os.path.join(PICTURE_FOLDER, picture_fn)
 
-    try:
-        from PIL import Image
-        output_size = (300, 300)
-        img = Image.open(form_picture)
-        img.thumbnail(output_size)
-        img.save(picture_path)
-    except Exception:
-        # PIL unavailable — save raw file
-        form_picture.seek(0)
-        form_picture.save(picture_path)
+    if Image is not None:
+        try:
+            output_size = (300, 300)
+            img = Image.open(form_picture)
+            # Let libjpeg decode at a reduced scale (no-op for non-JPEG formats)
+            img.draft(img.mode, (output_size[0] * 2, output_size[1] * 2))
+            img.thumbnail(output_size, Image.Resampling.BILINEAR)
+            img.save(picture_path, optimize=True, quality=85)
+            return picture_fn
+        except Exception:
+            # Undecodable image — fall through and keep the original bytes
+            pass
+
+    # PIL unavailable or failed — save raw file
+    form_picture.seek(0)
+    form_picture.save(picture_path)
 
     return picture_fn   # ← ONLY filename, never a full path
 
@@ -99,18 +124,41 @@ def save_cv(form_cv) -> str:
     return cv_fn   # ← ONLY filename
 
 
+# Computed once: avatar filenames are generated (uuid hex), so plain
+# concatenation is safe and skips a URL-map lookup per feed card.
+STATIC_PROFILE_PREFIX = f"{app.static_url_path}/uploads/profile_pics/"
+
+
 def profile_image_url(filename: str) -> str:
     """
     Always returns a valid URL for a profile image.
     Falls back to default_profile.png if filename is missing or empty.
     """
     fn = filename if filename else "default_profile.png"
-    return url_for("static", filename=f"uploads/profile_pics/{fn}")
+    return STATIC_PROFILE_PREFIX + fn
 
 
 # Expose helper to Jinja2 templates
 app.jinja_env.globals["profile_image_url"] = profile_image_url
 
+
+@app.after_request
+def cache_profile_pictures(response):
+    """
+    Uploaded avatars are stored under unique generated filenames and never
+    rewritten, so browsers (and any proxy in front of us) may keep them for
+    30 days. default_profile.* keeps a fixed name and is regenerated by
+    create_default_avatar.py, so it gets the normal static caching.
+    """
+    path = request.path
+    if (
+        path.startswith(STATIC_PROFILE_PREFIX)
+        and not path[len(STATIC_PROFILE_PREFIX):].startswith("default_profile.")
+        and response.status_code in (200, 304)
+    ):
+        response.headers["Cache-Control"] = "public, max-age=2592000, immutable"
+    return response
+
 # ─────────────────────────────────────────────────────────────────────────────
 #  User Loader
 # ─────────────────────────────────────────────────────────────────────────────
@@ -124,6 +172,11 @@ def load_user(user_id):
 # ─────────────────────────────────────────────────────────────────────────────
 
 @app.route("/")
+@cache.cached(
+    timeout=3600,
+    # Never cache the redirect for members or a page carrying flash messages
+    unless=lambda: current_user.is_authenticated or bool(session.get("_flashes")),
+)
 def landing():
     """CS Community welcome/marketing page."""
     if current_user.is_authenticated:
@@ -164,6 +217,7 @@ def register():
             user.set_password(form.password.data)
             db.session.add(user)
             db.session.commit()
+            cache.delete_memoized(_search_users)
             flash("Welcome to CS Community! Your account is ready.", "success")
             return redirect(url_for("login"))
 
@@ -179,6 +233,7 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user and user.check_password(form.password.data):
+            db.session.commit()   # persist a password hash upgrade, if any
             login_user(user, remember=False)
             next_page = request.args.get("next")
             flash(f"Welcome back, {user.username}!", "success")
@@ -206,12 +261,22 @@ def home():
     Main feed with optional GET-based filters:
       ?track=Web Development
       ?available=yes
-    Both can be combined.
+      ?page=2
+    All can be combined.
     """
     track_filter = request.args.get("track", "").strip()
     available_filter = request.args.get("available", "").strip()
+    page = request.args.get("page", 1, type=int)
+
+    # Load each post's author in the same query (avoids one SELECT per card).
+    # When filtering on User columns, reuse that join instead of adding a second.
+    if track_filter or available_filter == "yes":
+        query = Post.query.join(Post.author).options(contains_eager(Post.author))
+    else:
+        query = Post.query.options(joinedload(Post.author))
 
-    query = Post.query.join(User)
+    # Cards render Post.excerpt; the full TEXT body is only needed on post_detail
+    query = query.options(defer(Post.content))
 
     if track_filter:
         query = query.filter(User.track == track_filter)
@@ -219,11 +284,26 @@ def home():
     if available_filter == "yes":
         query = query.filter(User.available_for_project == True)
 
-    posts = query.order_by(Post.date.desc()).all()
+    pagination = query.order_by(Post.date.desc()).paginate(
+        page=page, per_page=FEED_PAGE_SIZE, error_out=False
+    )
+    posts = pagination.items
+    post_ids = [p.id for p in posts]
+
+    # One IN query for the viewer's like state across the whole page
+    liked_ids = set()
+    if post_ids:
+        liked_ids = {
+            post_id for (post_id,) in db.session.query(Like.post_id).filter(
+                Like.user_id == current_user.id, Like.post_id.in_(post_ids)
+            )
+        }
 
     return render_template(
         "home.html",
         posts=posts,
+        pagination=pagination,
+        liked_ids=liked_ids,
         track_filter=track_filter,
         available_filter=available_filter,
     )
@@ -237,7 +317,11 @@ def home():
 def profile(user_id):
     user = User.query.get_or_404(user_id)
     posts = Post.query.filter_by(user_id=user.id).order_by(Post.date.desc()).all()
-    total_likes = sum((p.likes_count or 0) for p in posts)
+    total_likes = (
+        db.session.query(db.func.coalesce(db.func.sum(Post.likes_count), 0))
+        .filter(Post.user_id == user.id)
+        .scalar()
+    )
     return render_template("profile.html", user=user, posts=posts, total_likes=total_likes)
 
 
@@ -247,20 +331,22 @@ def me():
     return redirect(url_for("profile", user_id=current_user.id))
 
 
-@app.route("/network")
-@login_required
-def network():
+@cache.memoize(timeout=30)
+def _search_users(search_q, track_filter, avail_filter, exclude_id, page):
     """
-    People-first discovery page.
-    Filters operate via GET params: ?search=&track=&available=yes
-    Users are ordered: available first, then alphabetical username.
+    Run the /network query for one filter combination and page.
+    Returns (users, total) so the result can be cached.
     """
-    search_q      = request.args.get("search", "").strip()
-    track_filter  = request.args.get("track", "").strip()
-    avail_filter  = request.args.get("available", "").strip()
-
-    # Start with everyone except the current user
-    query = User.query.filter(User.id != current_user.id)
+    # Only the columns network.html renders — plain rows, no ORM instances.
+    # Start with everyone except the current user.
+    query = db.session.query(
+        User.id,
+        User.username,
+        User.profile_image,
+        User.track,
+        User.skills,
+        User.available_for_project,
+    ).filter(User.id != exclude_id)
 
     # Full-text search across username, skills, and track (case-insensitive)
     if search_q:
@@ -280,18 +366,40 @@ def network():
         query = query.filter(User.available_for_project == True)
 
     # Available first, then A→Z
-    users = query.order_by(
+    pagination = query.order_by(
         User.available_for_project.desc(),
         User.username.asc()
-    ).all()
+    ).paginate(page=page, per_page=NETWORK_PAGE_SIZE, error_out=False)
+
+    return pagination.items, pagination.total
+
+
+@app.route("/network")
+@login_required
+def network():
+    """
+    People-first discovery page.
+    Filters operate via GET params: ?search=&track=&available=yes&page=
+    Users are ordered: available first, then alphabetical username.
+    """
+    search_q      = request.args.get("search", "").strip()
+    track_filter  = request.args.get("track", "").strip()
+    avail_filter  = request.args.get("available", "").strip()
+    page          = max(request.args.get("page", 1, type=int), 1)
+
+    users, total = _search_users(
+        search_q, track_filter, avail_filter, current_user.id, page
+    )
 
     return render_template(
         "network.html",
         users=users,
+        page=page,
+        pages=max(math.ceil(total / NETWORK_PAGE_SIZE), 1),
         search_q=search_q,
         track_filter=track_filter,
         avail_filter=avail_filter,
-        total=len(users),
+        total=total,
     )
 
 
@@ -317,6 +425,7 @@ def edit_profile():
             current_user.profile_image = save_picture(form.profile_image.data)
 
         db.session.commit()
+        cache.delete_memoized(_search_users)
         flash("Profile updated successfully.", "success")
         return redirect(url_for("profile", user_id=current_user.id))
 
@@ -382,9 +491,16 @@ def new_post():
 @app.route("/post/<int:post_id>")
 @login_required
 def post_detail(post_id):
-    post = Post.query.get_or_404(post_id)
-    comments = Comment.query.filter_by(post_id=post.id).order_by(Comment.date.asc()).all()
-    liked = Like.query.filter_by(user_id=current_user.id, post_id=post.id).first() is not None
+    post = Post.query.options(joinedload(Post.author)).get_or_404(post_id)
+    comments = (
+        Comment.query.options(joinedload(Comment.author))
+        .filter_by(post_id=post.id)
+        .order_by(Comment.date.asc())
+        .all()
+    )
+    liked = db.session.query(
+        Like.query.filter_by(user_id=current_user.id, post_id=post.id).exists()
+    ).scalar()
 
     return render_template(
         "post_detail.html",
@@ -480,28 +596,88 @@ def delete_comment(comment_id):
     return redirect(url_for("post_detail", post_id=post_id))
 
 # ─────────────────────────────────────────────────────────────────────────────
-#  Like Route
+#  Like Routes
 # ─────────────────────────────────────────────────────────────────────────────
 
+def _toggle_like(post_id: int):
+    """
+    Flip the current user's like on a post using atomic SQL statements.
+    Returns (liked, likes_count); aborts with 404 if the post doesn't exist.
+    The caller commits.
+    """
+    # Removing an existing like tells us its state in the same statement
+    removed = db.session.execute(
+        delete(Like).where(Like.user_id == current_user.id, Like.post_id == post_id)
+    ).rowcount
+
+    if removed:
+        likes_count = db.session.execute(
+            update(Post)
+            .where(Post.id == post_id)
+            .values(likes_count=db.case((Post.likes_count > 0, Post.likes_count - 1), else_=0))
+            .returning(Post.likes_count)
+        ).scalar()
+        return False, likes_count
+
+    # ON CONFLICT DO NOTHING: if a concurrent request liked the post first,
+    # the insert is a no-op instead of a unique-constraint error
+    dialect = db.session.get_bind().dialect.name
+    dialect_insert = sqlite_insert if dialect == "sqlite" else pg_insert
+    try:
+        inserted = db.session.execute(
+            dialect_insert(Like)
+            .values(user_id=current_user.id, post_id=post_id)
+            .on_conflict_do_nothing()
+        ).rowcount
+    except IntegrityError:
+        # Foreign key violation — the post doesn't exist
+        db.session.rollback()
+        abort(404)
+
+    if inserted == 1:
+        likes_count = db.session.execute(
+            update(Post)
+            .where(Post.id == post_id)
+            .values(likes_count=Post.likes_count + 1)
+            .returning(Post.likes_count)
+        ).scalar()
+    else:
+        likes_count = db.session.scalar(db.select(Post.likes_count).where(Post.id == post_id))
+    if likes_count is None:
+        db.session.rollback()
+        abort(404)
+    return True, likes_count
+
+
 @app.route("/post/<int:post_id>/like", methods=["POST"])
 @login_required
 def toggle_like(post_id):
-    post = Post.query.get_or_404(post_id)
-    existing = Like.query.filter_by(user_id=current_user.id, post_id=post.id).first()
-    if existing:
-        db.session.delete(existing)
-        post.likes_count = max((post.likes_count or 1) - 1, 0)
-        flash("Like removed.", "info")
-    else:
-        db.session.add(Like(user_id=current_user.id, post_id=post.id))
-        post.likes_count = (post.likes_count or 0) + 1
+    """Form fallback for browsers without JavaScript."""
+    liked, _ = _toggle_like(post_id)
+    db.session.commit()
+    if liked:
         flash("Post liked!", "success")
+    else:
+        flash("Like removed.", "info")
+    return redirect(url_for("post_detail", post_id=post_id))
+
+
+@app.route("/api/post/<int:post_id>/like", methods=["POST"])
+@login_required
+def api_toggle_like(post_id):
+    """
+    JSON like toggle used by post_detail's fetch() call.
+    CSRF token travels in the X-CSRFToken header.
+    Returns {"liked": bool, "count": int}.
+    """
     try:
-        db.session.commit()
-    except IntegrityError:
-        db.session.rollback()
-        flash("Database error. Please try again.", "danger")
-    return redirect(url_for("post_detail", post_id=post.id))
+        validate_csrf(request.headers.get("X-CSRFToken"))
+    except ValidationError:
+        return jsonify(error="Invalid CSRF token."), 400
+
+    liked, likes_count = _toggle_like(post_id)
+    db.session.commit()
+    return jsonify(liked=liked, count=likes_count)
 
 # ─────────────────────────────────────────────────────────────────────────────
 #  Utility Routes
@@ -516,6 +692,95 @@ def clear_session():
     return redirect(url_for("login"))
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+#  CLI Commands
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _rebuild_sqlite_table(conn, table) -> None:
+    """
+    SQLite can't ALTER a column's constraints: copy the rows into a table
+    created from the current model, then swap it in under the old name.
+    """
+    preparer = conn.dialect.identifier_preparer
+    new_table = table.to_metadata(db.MetaData(), name=f"{table.name}_new")
+    conn.execute(CreateTable(new_table))   # indexes are recreated by the caller
+    columns = ", ".join(preparer.quote(c.name) for c in table.columns)
+    conn.exec_driver_sql(
+        f"INSERT INTO {preparer.format_table(new_table)} ({columns}) "
+        f"SELECT {columns} FROM {preparer.format_table(table)}"
+    )
+    conn.exec_driver_sql(f"DROP TABLE {preparer.format_table(table)}")
+    conn.exec_driver_sql(
+        f"ALTER TABLE {preparer.format_table(new_table)} "
+        f"RENAME TO {preparer.format_table(table)}"
+    )
+
+
+def _upgrade_schema() -> None:
+    """
+    Bring a database created by an older version of models.py up to date.
+    db.create_all() only creates missing tables, so this also adds missing
+    columns and indexes, and lets user.password_hash be NULL for Google-only
+    accounts. Safe to re-run.
+    """
+    db.create_all()
+    with db.engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            # A table rebuild drops the old table; with foreign keys on, that
+            # would cascade-delete every post and comment referencing it
+            conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        else:
+            # The trigram indexes need pg_trgm; create_all() only installs it
+            # along with a brand-new user table
+            conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        inspector = inspect(conn)
+        preparer = conn.dialect.identifier_preparer
+        for table in db.metadata.sorted_tables:
+            existing = {c["name"]: c for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                        f"{CreateColumn(column).compile(dialect=conn.dialect)}"
+                    )
+            password_hash = existing.get("password_hash")
+            if table is User.__table__ and password_hash and not password_hash["nullable"]:
+                if conn.dialect.name == "sqlite":
+                    _rebuild_sqlite_table(conn, table)
+                else:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {preparer.format_table(table)} "
+                        "ALTER COLUMN password_hash DROP NOT NULL"
+                    )
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        conn.commit()
+
+
+@app.cli.command("backfill-posts")
+def backfill_posts():
+    """
+    Upgrade an existing database to the current schema, then fill
+    Post.excerpt and recount Post.comments_count for rows created before
+    those columns existed. Safe to re-run.
+    """
+    _upgrade_schema()
+    posts = Post.query.filter(Post.excerpt.is_(None), Post.content.isnot(None))
+    updated = 0
+    for post in posts.yield_per(500):
+        post.excerpt = make_excerpt(post.content)
+        updated += post.excerpt is not None
+
+    comment_count = (
+        db.select(db.func.count(Comment.id))
+        .where(Comment.post_id == Post.id)
+        .scalar_subquery()
+    )
+    db.session.execute(update(Post).values(comments_count=comment_count))
+    db.session.commit()
+    click.echo(f"Backfilled {updated} post excerpts and recounted comments.")
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 #  Entry Point
 # ─────────────────────────────────────────────────────────────────────────────
@@ -14,6 +14,15 @@ class BaseConfig:  # development / production
     REMEMBER_COOKIE_DURATION = timedelta(seconds=0)
     REMEMBER_COOKIE_REFRESH_EACH_REQUEST = False
 
+    # Public origin (e.g. https://cs-community.example.com) used to build the
+    # Google OAuth callback URL at startup; resolved on first login if unset
+    EXTERNAL_BASE_URL = os.environ.get("EXTERNAL_BASE_URL")
+
+    # Flask-Caching: Redis when REDIS_URL is set, otherwise per-process memory
+    CACHE_TYPE = "RedisCache" if os.environ.get("REDIS_URL") else "SimpleCache"
+    CACHE_REDIS_URL = os.environ.get("REDIS_URL")
+    CACHE_DEFAULT_TIMEOUT = 60  # seconds
+
 
 class DevConfig(BaseConfig):  # coding / testing
 
@@ -1,7 +1,8 @@
 """
 create_default_avatar.py
-Run once: python create_default_avatar.py
-Creates static/uploads/profile_pics/default_profile.png
+Build-time helper: python create_default_avatar.py
+Creates static/uploads/profile_pics/default_profile.png, which is committed
+and served as a static asset — the app never runs this at request time.
 """
 import os
 import sys
@@ -30,7 +31,8 @@ def make_with_pillow():
         [cx - body_r, size - 40, cx + body_r, size + body_r],
         fill="#a0aec0"
     )
-    img.save(TARGET, "PNG")
+    # Max compression: the file is produced once and downloaded many times
+    img.save(TARGET, "PNG", optimize=True, compress_level=9)
     print(f"✅  Created: {TARGET}")
 
 def make_with_svg_fallback():
@@ -0,0 +1,7 @@
+"""
+extensions.py — Flask extension objects shared across modules.
+Bound to the app in app.py via init_app().
+"""
+from flask_caching import Cache
+
+cache = Cache()
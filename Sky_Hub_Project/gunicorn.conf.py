@@ -0,0 +1,23 @@
+"""
+gunicorn.conf.py — picked up automatically by `gunicorn app:app`
+when started from this directory.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Threaded workers: Argon2 hashing (login/register) runs in C and releases
+# the GIL, so other requests keep being served while a password is hashed.
+#
+# For bursts of Google sign-ins, set GUNICORN_WORKER_CLASS=gevent (after
+# `pip install gevent`): gunicorn monkey-patches socket/ssl, so the blocking
+# token exchange in oauth.py yields instead of holding a thread. Password
+# hashing then blocks the whole worker while it runs, so keep gthread if
+# most traffic is password logins.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+
+if worker_class == "gthread":
+    threads = int(os.environ.get("GUNICORN_THREADS", 4))
+else:
+    worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 500))
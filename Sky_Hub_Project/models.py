@@ -1,10 +1,20 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import validates
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 
 db = SQLAlchemy()
 
+# Length of the feed preview stored in Post.excerpt
+EXCERPT_LENGTH = 500
+
+# Argon2id hasher shared by all users (time_cost/memory_cost tuned for ~tens of ms)
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+
 
 class User(db.Model, UserMixin):
     """Platform member — CS Community academic network."""
@@ -12,7 +22,8 @@ class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(256), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=True)  # NULL for Google-only accounts
+    google_id = db.Column(db.String(255), unique=True, index=True, nullable=True)  # Google OIDC "sub"
 
     # Academic identity fields
     track = db.Column(db.String(50), nullable=True)           # e.g. "Web Development", "AI & ML"
@@ -34,29 +45,76 @@ class User(db.Model, UserMixin):
     comments = db.relationship("Comment", back_populates="author", cascade="all, delete-orphan")
     likes = db.relationship("Like", back_populates="user", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Feed filter on track; /network orders by availability then username
+        db.Index("ix_user_track", "track"),
+        db.Index("ix_user_avail_username", "available_for_project", "username"),
+        # Trigram GIN indexes serve the /network ILIKE '%q%' search (PostgreSQL only)
+        db.Index(
+            "ix_user_username_trgm", "username",
+            postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        db.Index(
+            "ix_user_skills_trgm", "skills",
+            postgresql_using="gin", postgresql_ops={"skills": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
+
     def set_password(self, password: str) -> None:
         """Hash and store the password securely."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password: str) -> bool:
-        """Verify a plaintext password against the stored hash."""
-        return check_password_hash(self.password_hash, password)
+        """
+        Verify a plaintext password against the stored hash.
+        Legacy Werkzeug (PBKDF2) hashes and Argon2 hashes with outdated
+        parameters are transparently re-hashed on success; the caller
+        is responsible for committing the session.
+        """
+        if not self.password_hash:
+            return False
+
+        if not self.password_hash.startswith("$argon2"):
+            if not check_password_hash(self.password_hash, password):
+                return False
+            self.set_password(password)
+            return True
+
+        try:
+            password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+        if password_hasher.check_needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
     def has_liked(self, post) -> bool:
         """Return True if this user has already liked the given post."""
-        return any(like.post_id == post.id for like in self.likes)
+        return db.session.query(
+            Like.query.filter_by(user_id=self.id, post_id=post.id).exists()
+        ).scalar()
 
     def get_profile_image_url(self):
         """Return the correct filename for the profile image, falling back to default."""
         return self.profile_image if self.profile_image else 'default_profile.png'
 
 
+def make_excerpt(content):
+    """Return the feed preview for a post body, or None if it is empty."""
+    text = content or ""
+    if len(text) > EXCERPT_LENGTH:
+        text = text[:EXCERPT_LENGTH].rstrip() + "…"
+    return text or None
+
+
 class Post(db.Model):
     """A member's post/update on the CS Community feed."""
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=True)
+    excerpt = db.Column(db.String(EXCERPT_LENGTH + 1), nullable=True)  # feed preview of content
     image_file = db.Column(db.String(150), nullable=True)
     video_file = db.Column(db.String(150), nullable=True)
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -66,10 +124,24 @@ class Post(db.Model):
     )
     author = db.relationship("User", back_populates="posts")
     likes_count = db.Column(db.Integer, nullable=False, default=0)
+    comments_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     comments = db.relationship("Comment", back_populates="post", cascade="all, delete-orphan")
     likes = db.relationship("Like", back_populates="post", cascade="all, delete-orphan")
 
+    # Feed orders by date; profile filters by user then orders by date.
+    # B-tree indexes scan backwards just as well, so DESC order is served too.
+    __table_args__ = (
+        db.Index("ix_post_user_date", "user_id", "date"),
+        db.Index("ix_post_date", "date"),
+    )
+
+    @validates("content")
+    def _sync_excerpt(self, key, value):
+        """Keep the feed excerpt in step with content so the feed can defer content."""
+        self.excerpt = make_excerpt(value)
+        return value
+
 
 class Comment(db.Model):
     """A comment left on a post."""
@@ -88,6 +160,39 @@ class Comment(db.Model):
     author = db.relationship("User", back_populates="comments")
     post = db.relationship("Post", back_populates="comments")
 
+    # post_detail lists a post's comments in date order
+    __table_args__ = (db.Index("ix_comment_post_date", "post_id", "date"),)
+
+
+# gin_trgm_ops needs the pg_trgm extension before the user table is created
+event.listen(
+    User.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
+@event.listens_for(Comment, "after_insert")
+def _increment_comments_count(mapper, connection, comment):
+    """Keep Post.comments_count in step with new comments."""
+    posts = Post.__table__
+    connection.execute(
+        posts.update()
+        .where(posts.c.id == comment.post_id)
+        .values(comments_count=posts.c.comments_count + 1)
+    )
+
+
+@event.listens_for(Comment, "after_delete")
+def _decrement_comments_count(mapper, connection, comment):
+    """Keep Post.comments_count in step with deleted comments."""
+    posts = Post.__table__
+    connection.execute(
+        posts.update()
+        .where(posts.c.id == comment.post_id, posts.c.comments_count > 0)
+        .values(comments_count=posts.c.comments_count - 1)
+    )
+
 
 class Like(db.Model):
     """A like reaction on a post (unique per user per post)."""
@@ -104,4 +209,6 @@ class Like(db.Model):
     user = db.relationship("User", back_populates="likes")
     post = db.relationship("Post", back_populates="likes")
 
+    # The unique constraint is backed by an index on (user_id, post_id) in both
+    # SQLite and PostgreSQL, so like lookups need no extra index.
     __table_args__ = (db.UniqueConstraint("user_id", "post_id", name="uix_user_post"),)
@@ -3,14 +3,27 @@ oauth.py — Google OAuth 2.0 integration using Authlib
 Handles: login, callback, token exchange, user creation/lookup
 """
 import os
-import uuid
-import urllib.request
+import secrets
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from authlib.integrations.flask_client import OAuth
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from authlib.integrations.flask_client import OAuth, FlaskOAuth2App
 from flask import (
-    Blueprint, redirect, url_for, session, flash, current_app
+    Blueprint, redirect, url_for, flash, current_app
 )
 from flask_login import login_user, current_user
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+# models imports nothing from this module or app.py, so no import cycle
+from models import db, User
+from extensions import cache
 
 # ─────────────────────────────────────────────────────────────────────────────
 #  Blueprint
@@ -18,22 +31,145 @@ from flask_login import login_user, current_user
 
 google_bp = Blueprint("google_auth", __name__, url_prefix="/auth")
 
-# Module-level OAuth object (registered on app in create_app / app.py)
-oauth = OAuth()
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Pooled outbound HTTP
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _PersistentHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pool survives Session.close() — it lives for the process."""
+
+    def close(self):
+        pass
+
+
+# One keep-alive pool for every call to Google (discovery, JWKS, token
+# exchange, avatars), so TCP+TLS handshakes are paid once per host.
+_HTTPS_ADAPTER = _PersistentHTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.2),   # idempotent methods only
+)
+_HTTP = requests.Session()
+_HTTP.mount("https://", _HTTPS_ADAPTER)
+
+
+class _GoogleOAuth2App(FlaskOAuth2App):
+    """Authlib client that sends its token/JWKS requests through the shared pool."""
+
+    def _get_oauth_client(self, **metadata):
+        # Authlib builds a short-lived session per call; give it the shared pool
+        client = super()._get_oauth_client(**metadata)
+        client.mount("https://", _HTTPS_ADAPTER)
+        return client
+
+    def fetch_jwk_set(self, force=False):
+        """
+        Used by parse_id_token. Serves the cached JWKS; Authlib calls it
+        again with force=True when a token's kid isn't in the set (key
+        rotation), which is the only time we go back to the network.
+        """
+        jwks = _DISCOVERY_CACHE["jwks"]
+        if force or jwks is None:
+            jwks = _refresh_jwks()
+        return jwks
+
+
+class _PooledOAuth(OAuth):
+    oauth2_client_cls = _GoogleOAuth2App
+
+
+# Module-level OAuth object, bound to the app when google_bp is registered
+oauth = _PooledOAuth()
+
+# Credentials come from environment variables (set in .env / your OS).
+# Missing values raise KeyError here, at startup, not on the first login.
+_CLIENT_ID = os.environ["GOOGLE_CLIENT_ID"]
+_CLIENT_SECRET = os.environ["GOOGLE_CLIENT_SECRET"]
+
+GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+GOOGLE_ISSUER = "https://accounts.google.com"
+GOOGLE_JWKS_URL = "https://www.googleapis.com/oauth2/v3/certs"   # used until discovery loads
+
+# Google's published endpoints; replaced by the discovery document's values
+# whenever the discovery cache refreshes. The client is registered with
+# these instead of a server_metadata_url, so Authlib never blocks a login
+# on fetching the discovery document itself.
+_AUTH_ENDPOINT = "https://accounts.google.com/o/oauth2/v2/auth"
+_TOKEN_ENDPOINT = "https://oauth2.googleapis.com/token"
 
 google = oauth.register(
     name="google",
-    # Credentials come from environment variables (set in .env / your OS)
-    client_id=os.environ.get("GOOGLE_CLIENT_ID"),
-    client_secret=os.environ.get("GOOGLE_CLIENT_SECRET"),
-    # Discovery URL — automatically fetches endpoints, scopes, JWKS, etc.
-    server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
+    client_id=_CLIENT_ID,
+    client_secret=_CLIENT_SECRET,
+    authorize_url=_AUTH_ENDPOINT,
+    access_token_url=_TOKEN_ENDPOINT,
+    # Stored as server metadata: parse_id_token checks "iss" against issuer
+    issuer=GOOGLE_ISSUER,
+    jwks_uri=GOOGLE_JWKS_URL,
     client_kwargs={
         "scope": "openid email profile",   # minimum required scopes
     },
 )
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+#  Discovery cache
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Google's OIDC discovery document + JWKS, fetched at boot and hourly after,
+# so logins never wait on accounts.google.com for endpoint/key metadata.
+DISCOVERY_TTL = 3600  # seconds
+_DISCOVERY_CACHE = {"doc": None, "jwks": None}
+
+
+def _fetch_json(url: str) -> dict:
+    resp = _HTTP.get(url, timeout=5)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _refresh_discovery(logger) -> None:
+    """
+    Fetch the discovery document and JWKS, store them in _DISCOVERY_CACHE and
+    copy them into the Authlib client's server metadata.
+    Reschedules itself every DISCOVERY_TTL seconds; failures keep the old data.
+    """
+    global _AUTH_ENDPOINT, _TOKEN_ENDPOINT
+    try:
+        doc = _fetch_json(GOOGLE_DISCOVERY_URL)
+        jwks = _fetch_json(doc["jwks_uri"])
+    except Exception as exc:
+        logger.warning("Could not refresh Google OIDC discovery cache: %s", exc)
+    else:
+        _DISCOVERY_CACHE.update(doc=doc, jwks=jwks)
+        google.server_metadata.update(doc, jwks=jwks)
+        _AUTH_ENDPOINT = doc.get("authorization_endpoint", _AUTH_ENDPOINT)
+        _TOKEN_ENDPOINT = doc.get("token_endpoint", _TOKEN_ENDPOINT)
+        google.authorize_url = _AUTH_ENDPOINT
+        google.access_token_url = _TOKEN_ENDPOINT
+
+    timer = threading.Timer(DISCOVERY_TTL, _refresh_discovery, args=(logger,))
+    timer.daemon = True
+    timer.start()
+
+
+def _refresh_jwks() -> dict:
+    """Re-fetch Google's signing keys through the pooled session."""
+    jwks_uri = (_DISCOVERY_CACHE["doc"] or {}).get("jwks_uri", GOOGLE_JWKS_URL)
+    jwks = _fetch_json(jwks_uri)
+    _DISCOVERY_CACHE["jwks"] = jwks
+    google.server_metadata["jwks"] = jwks
+    return jwks
+
+
+@google_bp.record_once
+def _warm_discovery_cache(state):
+    """Bind OAuth to the app and load Google's OIDC metadata once."""
+    oauth.init_app(state.app)
+    _refresh_discovery(state.app.logger)
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 #  Routes
 # ─────────────────────────────────────────────────────────────────────────────
@@ -44,21 +180,18 @@ def google_login():
     if current_user.is_authenticated:
         return redirect(url_for("home"))
 
-    # Generate a cryptographic nonce (prevents replay attacks)
-    nonce = uuid.uuid4().hex
-    session["oauth_nonce"] = nonce
-
-    redirect_uri = url_for("google_auth.google_callback", _external=True)
-    return google.authorize_redirect(redirect_uri, nonce=nonce)
+    # Cryptographic nonce (prevents replay attacks). Authlib keeps it with the
+    # state entry it already stores for CSRF, so we don't write it ourselves.
+    nonce = secrets.token_urlsafe(16)
+    return google.authorize_redirect(_callback_uri(), nonce=nonce)
 
 
 @google_bp.route("/google/callback")
 def google_callback():
     """Google redirects here after the user approves (or denies) access."""
-    # Lazy import to avoid circular imports
-    from models import db, User
-
     # ── 1. Exchange auth code for tokens ──────────────────────────────────
+    # Authlib checks `state`, then validates the ID token against the nonce
+    # saved with that state and returns the claims as token["userinfo"].
     try:
         token = google.authorize_access_token()
     except Exception as exc:
@@ -66,12 +199,10 @@ def google_callback():
         flash("Google sign-in failed. Please try again.", "danger")
         return redirect(url_for("login"))
 
-    # ── 2. Validate ID token (nonce check prevents replay) ────────────────
-    nonce = session.pop("oauth_nonce", None)
-    try:
-        user_info = google.parse_id_token(token, nonce=nonce)
-    except Exception as exc:
-        current_app.logger.error("ID token validation failed: %s", exc)
+    # ── 2. Validated ID token claims ──────────────────────────────────────
+    user_info = token.get("userinfo")
+    if not user_info:
+        current_app.logger.error("ID token missing from Google token response")
         flash("Authentication error. Please try again.", "danger")
         return redirect(url_for("login"))
 
@@ -80,75 +211,247 @@ def google_callback():
     name      = user_info.get("name", "")
     picture   = user_info.get("picture", "")  # Google-hosted avatar URL
 
+    if _is_default_google_picture(picture):
+        picture = ""   # generic silhouette — our own default looks the same
+
     if not google_id or not email:
         flash("Could not retrieve your Google account details.", "danger")
         return redirect(url_for("login"))
 
     # ── 3. Find or create the user ────────────────────────────────────────
-    user = User.query.filter_by(google_id=google_id).first()
+    # Returning users: cached google_id → PK, then a primary-key get
+    user = _cached_google_user(google_id)
+    from_cache = user is not None
+    matches = []
+    if user is None:
+        # One round-trip for both lookups; a google_id match wins over email
+        matches = User.query.filter(
+            db.or_(User.google_id == google_id, User.email == email)
+        ).all()
+        user = next((u for u in matches if u.google_id == google_id), None)
+    is_new_user = False
+    new_avatar = None   # filename to download into after commit, if any
 
     if user is None:
         # Maybe the email already exists (local account) — link Google ID
-        user = User.query.filter_by(email=email).first()
+        user = next((u for u in matches if u.email == email), None)
         if user:
             user.google_id = google_id
-            db.session.commit()
         else:
-            # Brand new user — download Google profile picture
-            profile_fn = _download_google_picture(picture, current_app)
+            # Brand new user — the avatar is fetched in the background once
+            # the row exists. Until it lands the image URL 404s, and each
+            # avatar <img> swaps in the default through its onerror handler.
+            profile_fn = secrets.token_hex(12) + ".jpg" if picture else "default_profile.png"
 
-            # Sanitise username: replace spaces, ensure uniqueness
+            # Sanitise username: replace spaces; uniqueness is enforced on insert
             base_username = name.replace(" ", "_").lower()[:40]
-            username = _unique_username(base_username)
 
-            user = User(
-                username=user_info.get("given_name", username)[:50] or username,
+            user, is_new_user = _upsert_with_unique_username(dict(
+                username=(user_info.get("given_name") or base_username or "user")[:50],
                 email=email,
                 google_id=google_id,
                 profile_image=profile_fn,
                 available_for_project=True,
-            )
-            db.session.add(user)
-            db.session.commit()
-            flash(f"Welcome to CS Community, {user.username}! "
-                  "Complete your profile to get started.", "success")
+            ))
+            if user is None:
+                flash("Could not create your account. Please try again.", "danger")
+                return redirect(url_for("login"))
+            # If a concurrent sign-up created the row, it isn't ours to
+            # welcome or to download an avatar into
+            new_avatar = profile_fn if picture and is_new_user else None
+
+    # ── 4. Commit once, then log the user in ──────────────────────────────
+    db.session.commit()
+    if not from_cache:
+        cache.set(_user_cache_key(google_id), user.id, timeout=USER_ID_CACHE_TTL)
+
+    if new_avatar:
+        # Row is committed, so the worker can find it if the download fails
+        _AVATAR_POOL.submit(
+            _fetch_avatar_in_background,
+            picture, new_avatar, user.id, current_app._get_current_object(),
+        )
+    if is_new_user:
+        flash(f"Welcome to CS Community, {user.username}! "
+              "Complete your profile to get started.", "success")
 
-    # ── 4. Log the user in ────────────────────────────────────────────────
     login_user(user, remember=False)
     return redirect(url_for("home"))
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+#  Callback URI
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Resolved once at startup from EXTERNAL_BASE_URL. Without it the URL is
+# built from each request's Host header, which must not be cached.
+_CALLBACK_URI = None
+
+
+def _callback_uri() -> str:
+    """Return the absolute callback URL."""
+    if _CALLBACK_URI is not None:
+        return _CALLBACK_URI
+    return url_for("google_auth.google_callback", _external=True)
+
+
+# Defined after the routes so their URL rules exist when this runs
+@google_bp.record_once
+def _precompute_callback_uri(state):
+    """With EXTERNAL_BASE_URL configured, resolve the callback URL at startup."""
+    global _CALLBACK_URI
+    base_url = state.app.config.get("EXTERNAL_BASE_URL")
+    if base_url:
+        with state.app.test_request_context(base_url=base_url):
+            _CALLBACK_URI = url_for("google_auth.google_callback", _external=True)
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 #  Private helpers
 # ─────────────────────────────────────────────────────────────────────────────
 
-def _download_google_picture(picture_url: str, app) -> str:
+# Avatar downloads run here so the callback redirect never waits on Google's CDN
+_AVATAR_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="avatar")
+
+AVATAR_MAX_BYTES = 2 * 1024 * 1024   # refuse avatars larger than 2 MB
+AVATAR_CHUNK_SIZE = 64 * 1024
+
+# static/uploads/profile_pics, created once per process on first download
+_PROFILE_PIC_DIR = None
+_PROFILE_PIC_DIR_LOCK = threading.Lock()
+
+
+def _profile_pic_dir(app) -> str:
+    """Return the avatar directory, creating it exactly once."""
+    global _PROFILE_PIC_DIR
+    if _PROFILE_PIC_DIR is None:
+        with _PROFILE_PIC_DIR_LOCK:
+            if _PROFILE_PIC_DIR is None:
+                path = os.path.join(app.root_path, "static", "uploads", "profile_pics")
+                os.makedirs(path, exist_ok=True)
+                _PROFILE_PIC_DIR = path
+    return _PROFILE_PIC_DIR
+
+
+# Path segment Google uses for the generic "no photo" silhouette
+_GOOGLE_DEFAULT_PICTURE_MARKER = "/AAAAAAAAAAI/"
+
+
+def _is_default_google_picture(picture_url: str) -> bool:
+    """True if the URL is Google's placeholder avatar, not a real photo."""
+    return _GOOGLE_DEFAULT_PICTURE_MARKER in (picture_url or "")
+
+
+def _download_google_picture(picture_url: str, filename: str, app) -> bool:
     """
-    Download a Google profile picture to static/uploads/profile_pics/.
-    Returns the filename (not full path).
-    Falls back to default_profile.png on any error.
+    Download a Google profile picture to static/uploads/profile_pics/<filename>.
+    Returns True on success, False on any error.
     """
-    if not picture_url:
-        return "default_profile.png"
+    tmp_path = None
     try:
-        ext = ".jpg"
-        filename = uuid.uuid4().hex + ext
-        dest = os.path.join(
-            app.root_path, "static", "uploads", "profile_pics", filename
+        pic_dir = _profile_pic_dir(app)
+        dest = os.path.join(pic_dir, filename)
+        with _HTTP.get(picture_url, stream=True, timeout=(3, 10)) as resp:   # nosec (trusted Google URL)
+            resp.raise_for_status()
+            # Write to a temp file in the same directory, then rename into
+            # place, so a partial download never appears under the real name.
+            with tempfile.NamedTemporaryFile(dir=pic_dir, suffix=".part", delete=False) as tmp:
+                tmp_path = tmp.name
+                written = 0
+                for chunk in resp.iter_content(chunk_size=AVATAR_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > AVATAR_MAX_BYTES:
+                        raise ValueError(f"avatar larger than {AVATAR_MAX_BYTES} bytes")
+                    tmp.write(chunk)
+        # mkstemp creates the file 0600; the static file server needs to read it
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, dest)
+        tmp_path = None
+        return True
+    except (requests.RequestException, OSError, ValueError) as exc:
+        # Expected failures (404, timeout, oversize, disk): one line, no traceback
+        app.logger.warning("avatar fetch failed url=%s err=%s", picture_url, type(exc).__name__)
+        return False
+    except Exception:
+        app.logger.exception("Unexpected error downloading Google avatar url=%s", picture_url)
+        return False
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _fetch_avatar_in_background(picture_url: str, filename: str, user_id: int, app) -> None:
+    """
+    Worker-thread task: download the avatar, and if that fails point the
+    user back at default_profile.png.
+    """
+    if _download_google_picture(picture_url, filename, app):
+        return
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        if user is not None and user.profile_image == filename:
+            user.profile_image = "default_profile.png"
+            db.session.commit()
+
+
+USER_ID_CACHE_TTL = 300  # seconds
+
+
+def _user_cache_key(google_id: str) -> str:
+    return f"user:gid:{google_id}"
+
+
+def _cached_google_user(google_id: str):
+    """
+    Return the User for a google_id via the cached primary key, or None on a
+    cache miss. Only the PK is cached and the row is re-checked, so a stale
+    entry just falls through to the normal lookup.
+    """
+    user_id = cache.get(_user_cache_key(google_id))
+    if user_id is None:
+        return None
+    user = db.session.get(User, user_id)
+    if user is None or user.google_id != google_id:
+        cache.delete(_user_cache_key(google_id))
+        return None
+    return user
+
+
+def _upsert_with_unique_username(values: dict, attempts: int = 4):
+    """
+    Create a Google user with INSERT ... ON CONFLICT (email) DO NOTHING
+    RETURNING, so a concurrent sign-up with the same email doesn't fail:
+    when the insert returns no row, that account is linked to google_id
+    instead. Username clashes rely on the UNIQUE constraint: append a short
+    random suffix and retry.
+    Returns (user, created); user is None if every attempt failed. The
+    caller commits.
+    """
+    dialect = db.session.get_bind().dialect.name
+    dialect_insert = sqlite_insert if dialect == "sqlite" else pg_insert
+    base = values["username"]
+    for _ in range(attempts):
+        stmt = (
+            dialect_insert(User).values(**values)
+            .on_conflict_do_nothing(index_elements=[User.email])
+            .returning(User)
         )
-        os.makedirs(os.path.dirname(dest), exist_ok=True)
-        urllib.request.urlretrieve(picture_url, dest)   # nosec (trusted Google URL)
-        return filename
-    except Exception as exc:
-        app.logger.warning("Could not download Google avatar: %s", exc)
-        return "default_profile.png"
-
-
-def _unique_username(base: str) -> str:
-    """Append a short UUID suffix if the username is already taken."""
-    from models import User
-    candidate = base or "user"
-    if not User.query.filter_by(username=candidate).first():
-        return candidate
-    suffix = uuid.uuid4().hex[:6]
-    return f"{candidate}_{suffix}"
+        try:
+            user = db.session.scalars(
+                stmt, execution_options={"populate_existing": True}
+            ).first()
+            if user is not None:
+                return user, True
+            # Someone else created this email first: link it to Google
+            user = db.session.scalars(
+                update(User)
+                .where(User.email == values["email"])
+                .values(google_id=values["google_id"])
+                .returning(User),
+                execution_options={"populate_existing": True},
+            ).one()
+            return user, False
+        except IntegrityError:
+            db.session.rollback()
+            values["username"] = f"{base[:43]}_{secrets.token_urlsafe(4)}"
+    return None, False